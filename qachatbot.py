@@ -1,8 +1,9 @@
 # qachatbot.py — uses your server-side key only (no user input)
-import os, re, json
+import os, re, json, sqlite3, threading, atexit, time, itertools, logging
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict
+from collections import OrderedDict
+from typing import List, Dict, Tuple
 import streamlit as st
 
 from dotenv import load_dotenv              # for local .env fallback
@@ -11,10 +12,54 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.messages import HumanMessage, AIMessage
 
+try:                                         # optional: faster history (de)serialization
+    import orjson
+except ImportError:
+    orjson = None
+
+try:                                         # optional: semantic response cache
+    import numpy as np
+    from fastembed import TextEmbedding
+except ImportError:
+    np = TextEmbedding = None
+
 # ---------------- CONFIG ----------------
 load_dotenv()  # reads .env locally; on Streamlit Cloud you'll use Secrets
 st.set_page_config(page_title="GEN QUIZ AI", page_icon="🤖", layout="wide")
-HISTORY_FILE = Path("quiz_history.json")
+HISTORY_FILE = Path("quiz_history.jsonl")
+LEGACY_HISTORY_FILE = Path("quiz_history.json")  # read once if no JSONL log exists yet
+COMPACT_AFTER = 100  # tombstones tolerated in the history log before it is rewritten
+WRITE_RETRY_SECONDS = 5  # back-off before the history writer retries a failed write
+logger = logging.getLogger(__name__)
+HISTORY_PAGE = 20  # history items rendered per "Show more" step
+CACHE_FILE = Path("mcq_cache.sqlite")
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Groq models by speed tier
+SPEED_MAP = {
+    "Instant": "llama-3.1-8b-instant",        # lowest latency
+    "Balanced": "llama-3.3-70b-versatile",
+}
+
+# MCQ parsing patterns
+_SPLIT_RE = re.compile(r'(?m)^(?=\d+\.\s)')
+_QNUM_RE = re.compile(r'^\d+\.\s*')
+_OPT_RE = re.compile(r'^([a-dA-D])[\.\)]\s+(.*)$')
+_ANS_RE = re.compile(r'answer:\s*([a-dA-D])\b', re.IGNORECASE)
+_QLINE_RE = re.compile(r'(?m)^\d+\.(?=\s)')
+
+# Larger sets are generated as parallel chunks
+CHUNK_MIN_QUESTIONS = 10
+GEN_CHUNKS = 2
+# Prompt focus per request: one broad focus for a single request, and a distinct
+# focus per chunk so parallel chunks don't ask the same questions.
+FULL_FOCUS = "broad coverage of the topic"
+CHUNK_FOCUSES = [
+    "core concepts and definitions",
+    "applications, examples and problem solving",
+    "comparisons, trade-offs and common mistakes",
+    "advanced details and edge cases",
+]
 
 # CSS for colored tiles
 st.markdown("""
@@ -30,24 +75,187 @@ st.title("GEN QUIZ AI")
 st.caption("Generate MCQs with Groq. Click an option to check; use 'Show answer' at the end.")
 
 # ---------------- PERSISTENCE ----------------
-def load_history() -> List[Dict]:
-    if HISTORY_FILE.exists():
+# History is an append-only JSONL log: one line per added item, deletes append a
+# {"id": ..., "_deleted": true} tombstone, and the file is compacted (rewritten
+# with live items only) once enough tombstones pile up.
+if orjson is not None:
+    def _dumps_line(x) -> bytes:
+        return orjson.dumps(x) + b"\n"
+    _loads = orjson.loads
+else:
+    def _dumps_line(x) -> bytes:
+        return json.dumps(x, ensure_ascii=False).encode("utf-8") + b"\n"
+    _loads = json.loads
+
+def _persisted(h: Dict) -> Dict:
+    # underscore keys are in-memory helpers (e.g. search index), never persisted
+    return {k: v for k, v in h.items() if not k.startswith("_")}
+
+def replay_history() -> Tuple[List[Dict], int]:
+    """Live items from the log in insertion order, plus the number of tombstones in it."""
+    state: Dict[int, Dict] = {}
+    dead = 0
+    with HISTORY_FILE.open("rb") as f:
+        for line in f:
+            try:
+                rec = _loads(line)
+            except Exception:
+                continue  # blank or torn line
+            if not isinstance(rec, dict) or "id" not in rec:
+                continue  # not a history record
+            if rec.get("_deleted"):
+                state.pop(rec["id"], None)
+                dead += 1
+            else:
+                state[rec["id"]] = rec
+    return list(state.values()), dead
+
+def save_history(items: List[Dict]):
+    """Rewrite the whole log with just `items` (used for compaction and clearing)."""
+    # write a sibling temp file and swap it in, so a crash mid-write leaves the old log intact
+    tmp = HISTORY_FILE.with_name(HISTORY_FILE.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(b"".join(_dumps_line(_persisted(h)) for h in items))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, HISTORY_FILE)
+
+def append_history(records: List[Dict]):
+    """Append already-persistable records (items or tombstones) to the log."""
+    with HISTORY_FILE.open("a+b") as f:
+        # after a torn write, start on a fresh line so the new records stay parseable
+        f.seek(0, os.SEEK_END)
+        prefix = b""
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                prefix = b"\n"
+        f.write(prefix + b"".join(_dumps_line(r) for r in records))
+
+def index_history_item(h: Dict) -> Dict:
+    """Attach lowercase copies of topic/response so search doesn't re-lowercase on every keystroke."""
+    h["_topic_l"] = h["topic"].lower()
+    h["_resp_l"] = h["response"].lower()
+    return h
+
+class HistoryWriter:
+    """Process-wide owner of the history log: batches appends off the rerun thread and compacts the file."""
+
+    def __init__(self, debounce: float = 0.5):
+        self._debounce = debounce
+        self._snapshot: List[Dict] | None = None  # pending full rewrite (Clear All)
+        self._appends: List[Dict] = []             # pending records, applied after the rewrite
+        self._dead = 0                             # tombstones currently in the file
+        self._next_id = 1                          # shared by all sessions so ids never collide
+        self._lock = threading.Lock()        # guards _snapshot/_appends
+        self._write_lock = threading.Lock()  # serializes file access and guards _dead
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def load(self) -> List[Dict]:
+        """Flush pending writes, then return the live items (migrating/compacting the file if needed)."""
+        with self._write_lock:
+            self._flush_locked()
+            if not HISTORY_FILE.exists():
+                if not LEGACY_HISTORY_FILE.exists():
+                    return []
+                try:  # pre-JSONL history: migrate it into the log
+                    items = _loads(LEGACY_HISTORY_FILE.read_bytes())
+                except Exception:
+                    return []
+                if not isinstance(items, list):
+                    return []
+                save_history([h for h in items if isinstance(h, dict) and "id" in h])
+            items, self._dead = replay_history()
+            self._maybe_compact_locked()
+            with self._lock:
+                self._next_id = max([self._next_id] + [h["id"] + 1 for h in items])
+            return items
+
+    def allocate_id(self) -> int:
+        with self._lock:
+            new_id = self._next_id
+            self._next_id += 1
+        return new_id
+
+    def append(self, record: Dict):
+        with self._lock:
+            self._appends.append(record)
+        self._wake.set()
+
+    def rewrite(self, items: List[Dict]):
+        """Replace the whole log with `items`; only used by Clear All."""
+        # records queued before the clear are superseded by it
+        with self._lock:
+            self._snapshot = list(items)
+            self._appends = []
+        self._wake.set()
+
+    def flush(self):
+        with self._write_lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        with self._lock:
+            snapshot, self._snapshot = self._snapshot, None
+            appends, self._appends = self._appends, []
         try:
-            return json.loads(HISTORY_FILE.read_text(encoding="utf-8"))
+            if snapshot is not None:
+                save_history(snapshot)
+                self._dead = 0
+                snapshot = None
+            if appends:
+                append_history(appends)
+                self._dead += sum(1 for r in appends if r.get("_deleted"))
+                appends = []
         except Exception:
-            return []
-    return []
+            # put the unwritten batch back (a newer Clear All supersedes it) so it is retried
+            with self._lock:
+                if self._snapshot is None:
+                    if snapshot is not None:
+                        self._snapshot = snapshot
+                    self._appends = appends + self._appends
+            raise
+        self._maybe_compact_locked()
+
+    def _maybe_compact_locked(self):
+        # replay the file itself, so items added by every session survive compaction
+        if self._dead > COMPACT_AFTER:
+            items, _ = replay_history()
+            save_history(items)
+            self._dead = 0
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self._debounce)  # let a burst of clicks coalesce into one write
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing %s failed; retrying in %ss", HISTORY_FILE, WRITE_RETRY_SECONDS)
+                time.sleep(WRITE_RETRY_SECONDS)
+                self._wake.set()
 
-def save_history(items: List[Dict]):
-    HISTORY_FILE.write_text(json.dumps(items, indent=2, ensure_ascii=False), encoding="utf-8")
+@st.cache_resource(show_spinner=False)
+def get_history_writer() -> HistoryWriter:
+    return HistoryWriter()
 
 # ---------------- SESSION DEFAULTS ----------------
-st.session_state.setdefault("history", load_history())
+if "history" not in st.session_state:
+    # id → item, in insertion order; materialized to a list only when saving
+    st.session_state.history = OrderedDict(
+        (h["id"], index_history_item(h)) for h in get_history_writer().load()
+    )
 st.session_state.setdefault("messages", [])
 st.session_state.setdefault("current_blocks", [])
 st.session_state.setdefault("current_raw", "")
 st.session_state.setdefault("current_topic", "")
 st.session_state.setdefault("current_num", 0)
+st.session_state.setdefault("_parsed_cache", {})  # history id → parsed blocks
+st.session_state.setdefault("_hist_page", HISTORY_PAGE)
 
 # ---------------- API KEY (Secrets → env/.env) ----------------
 def get_api_key() -> str | None:
@@ -60,96 +268,223 @@ def get_api_key() -> str | None:
 # ---------------- SIDEBAR (no key prompt) ----------------
 with st.sidebar:
     st.header("Settings")
-    model_name = st.selectbox("Model", ["llama-3.1-8b-instant", "llama-3.3-70b-versatile"])
+    tier = st.selectbox("Speed", list(SPEED_MAP))
+    model_name = SPEED_MAP[tier]
+    st.caption(f"Model: `{model_name}`")
+    deterministic = st.toggle("Reproducible / cacheable", value=True,
+                              help="Temperature 0, so repeat requests can be served from cache.")
     st.caption(f"📜 Saved runs: **{len(st.session_state.history)}**")
     if st.button("Clear All History 🧹"):
-        st.session_state.history = []
-        save_history([])
+        st.session_state.history = OrderedDict()
+        st.session_state._parsed_cache.clear()
+        get_history_writer().rewrite([])
         st.success("History cleared.")
         st.rerun()
 
 # ---------------- LLM ----------------
 @st.cache_resource(show_spinner=False)
-def get_llm(model_name: str):
+def get_llm(model_name: str, deterministic: bool = True):
     api_key = get_api_key()
     if not api_key:
         return None
-    return ChatGroq(groq_api_key=api_key, model_name=model_name, temperature=0.7)
+    return ChatGroq(groq_api_key=api_key, model_name=model_name,
+                    temperature=0.0 if deterministic else 0.7, streaming=True)
+
+llm = get_llm(model_name, deterministic)
+
+# ---------------- SEMANTIC CACHE ----------------
+class SemanticCache:
+    """SQLite store of raw MCQ text keyed by topic embedding; lookups match by cosine similarity."""
+
+    def __init__(self, path: Path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "id INTEGER PRIMARY KEY, model TEXT, num INTEGER, key TEXT, emb BLOB, response TEXT)"
+        )
+        self._conn.commit()
+
+    def get(self, emb, threshold: float = 0.9, filter: Dict | None = None) -> str | None:
+        filter = filter or {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT emb, response FROM cache WHERE model = ? AND num = ?",
+                (filter.get("model"), filter.get("num")),
+            ).fetchall()
+        if not rows:
+            return None
+        # embeddings are stored L2-normalized, so cosine similarity is a dot product
+        mat = np.frombuffer(b"".join(r[0] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+        sims = mat @ emb
+        best = int(sims.argmax())
+        return rows[best][1] if sims[best] >= threshold else None
+
+    def set(self, emb, response: str, model: str, num: int, key: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO cache (model, num, key, emb, response) VALUES (?, ?, ?, ?, ?)",
+                (model, int(num), key, emb.astype(np.float32).tobytes(), response),
+            )
+            self._conn.commit()
 
-llm = get_llm(model_name)
+# Load errors propagate so st.cache_resource doesn't cache them; the next request retries.
+@st.cache_resource(show_spinner="Loading embedding model…")
+def get_embedder():
+    if TextEmbedding is None:
+        return None
+    return TextEmbedding(model_name=EMBED_MODEL)
+
+@st.cache_resource(show_spinner=False)
+def get_cache() -> SemanticCache:
+    return SemanticCache(CACHE_FILE)
+
+def embed(text: str):
+    """Normalized float32 embedding of `text`, or None when the embedder isn't available."""
+    try:
+        embedder = get_embedder()
+        if embedder is None:
+            return None
+        vec = next(iter(embedder.embed([text]))).astype(np.float32)
+    except Exception as e:  # model download/load failed; skip the cache this time
+        st.toast(f"Response cache unavailable: {e}")
+        return None
+    return vec / (np.linalg.norm(vec) or 1.0)
 
 # ---------------- PROMPT / CHAIN ----------------
+# Static text first, variables last: keeps the prompt prefix byte-identical across requests
+# so provider-side prompt caching can kick in.
 mcq_prompt = ChatPromptTemplate.from_messages([
-    ("system", "You are an expert exam question setter. Generate multiple-choice questions (MCQs) on the given topic."),
-    ("user", """Topic: {topic}
-Number of Questions: {num_questions}
-
-Instructions:
-1. Each question must be clear and concise.
-2. Provide 4 options (a, b, c, d).
-3. Only one option should be correct.
-4. After each question, include: Answer: <a|b|c|d>
-5. Number questions like: 1., 2., 3., ...
-""")
+    ("system", "You write MCQs. Output only the questions."),
+    ("user", """Format each question exactly as:
+1. <question>
+a) <option>
+b) <option>
+c) <option>
+d) <option>
+Answer: <a|b|c|d>
+Number questions 1., 2., 3., ... One correct option each. Keep questions concise.
+
+Questions: {num_questions}
+Focus: {focus}
+Topic: {topic}""")
 ])
-chain = (mcq_prompt | llm | StrOutputParser()) if llm else None
+
+def max_tokens_for(num_questions: int) -> int:
+    """Output budget: ~130 tokens per question, capped."""
+    return min(4096, 130 * int(num_questions))
+
+@st.cache_resource(show_spinner=False)
+def build_chain(model_name: str, deterministic: bool, max_tokens: int):
+    llm = get_llm(model_name, deterministic)
+    return (mcq_prompt | llm.bind(max_tokens=max_tokens) | StrOutputParser()) if llm else None
+
+def gen_chunked(model_name: str, deterministic: bool, topic: str, n: int,
+                chunks: int = GEN_CHUNKS) -> List[str]:
+    """Generate `n` questions as `chunks` concurrent requests; returns the raw outputs in order."""
+    sizes = [size for size in (n // chunks + (i < n % chunks) for i in range(chunks)) if size]
+    inputs = [
+        {"topic": topic, "num_questions": size, "focus": CHUNK_FOCUSES[i % len(CHUNK_FOCUSES)]}
+        for i, size in enumerate(sizes)
+    ]
+    # batch() runs on a thread pool with the sync client; asyncio.run() here would bind the
+    # cached ChatGroq's async HTTP client to a loop that is closed after the first set
+    chain = build_chain(model_name, deterministic, max_tokens_for(max(sizes)))
+    return chain.batch(inputs, config={"max_concurrency": chunks})
+
+def join_chunks(raws: List[str]) -> str:
+    """Concatenate chunk outputs and renumber questions 1..N across them."""
+    counter = itertools.count(1)
+    return _QLINE_RE.sub(lambda _m: f"{next(counter)}.", "\n\n".join(r.strip() for r in raws))
+
+def generate_mcqs(model_name: str, deterministic: bool, topic: str, num_questions: int) -> str:
+    """Raw MCQ text from the LLM: streamed into the page, or chunked for large sets."""
+    if num_questions >= CHUNK_MIN_QUESTIONS:
+        # big sets: concurrent chunks beat one long serial generation
+        with st.spinner("Generating…"):
+            raws = gen_chunked(model_name, deterministic, topic, num_questions)
+        return join_chunks(raws)
+    else:
+        # stream tokens into a placeholder so output shows up immediately
+        placeholder = st.empty()
+        buf = []
+        chain = build_chain(model_name, deterministic, max_tokens_for(num_questions))
+        for chunk in chain.stream(
+            {"topic": topic, "num_questions": num_questions, "focus": FULL_FOCUS}
+        ):
+            buf.append(chunk)
+            placeholder.markdown("".join(buf))
+        return "".join(buf)
 
 # ---------------- HELPERS ----------------
+@st.cache_data(max_entries=512, show_spinner=False)
 def parse_mcqs(text: str) -> List[Dict]:
     """Return list of dicts: {question, options(['a) ...']), answer('a'|'b'|'c'|'d')}"""
-    parts = re.split(r'(?m)^(?=\d+\.\s)', text.strip())
+    parts = _SPLIT_RE.split(text.strip())
     out = []
     for block in parts:
         block = block.strip()
         if not block:
             continue
-        lines = [l.strip() for l in block.splitlines() if l.strip()]
-        if not lines:
-            continue
-
-        q_line = re.sub(r'^\d+\.\s*', '', lines[0])
-
-        opt_pat = re.compile(r'^([a-dA-D])[\.\)]\s+(.*)$')
+        q_line = None
         options_raw = []
-        for l in lines[1:]:
-            m = opt_pat.match(l)
+        ans = ""
+        for raw_l in block.splitlines():
+            l = raw_l.strip()
+            if not l:
+                continue
+            # the answer may sit on any line, including the question or an option line
+            if not ans:
+                m = _ANS_RE.search(l)
+                if m:
+                    ans = m.group(1).lower()
+            if q_line is None:
+                q_line = _QNUM_RE.sub('', l)
+                continue
+            m = _OPT_RE.match(l)
             if m:
                 letter = m.group(1).lower()
                 text_only = m.group(2).strip()
                 options_raw.append(f"{letter}) {text_only}")  # keep a) style
-
-        ans = ""
-        for l in lines:
-            m = re.search(r'answer:\s*([a-dA-D])\b', l, re.IGNORECASE)
-            if m:
-                ans = m.group(1).lower()
+            if ans and len(options_raw) >= 4:
                 break
 
         if q_line and options_raw:
             out.append({"question": q_line, "options": options_raw[:4], "answer": ans})
     return out
 
+def parsed_history_blocks(h: Dict) -> List[Dict]:
+    """Parsed MCQs for a history item, memoized per id in session state."""
+    pc = st.session_state._parsed_cache
+    if h["id"] not in pc:
+        pc[h["id"]] = parse_mcqs(h["response"])
+    return pc[h["id"]]
+
 def add_to_history(topic: str, num: int, response: str):
     items = st.session_state.history
-    new_id = (items[-1]["id"] + 1) if items else 1
-    items.append({
+    new_id = get_history_writer().allocate_id()
+    items[new_id] = index_history_item({
         "id": new_id,
-        "ts": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "ts": datetime.now().isoformat(timespec="minutes").replace("T", " "),  # YYYY-MM-DD HH:MM
         "topic": topic,
         "num": int(num),
         "response": response
     })
-    save_history(items)
-
-def clear_selection_state(_max_q: int):
-    to_delete = []
-    for k in list(st.session_state.keys()):
-        if k.startswith("sel_") or k.startswith("rev_"):
-            to_delete.append(k)
-    for k in to_delete:
+    get_history_writer().append(_persisted(items[new_id]))
+
+def delete_from_history(hid: int):
+    st.session_state.history.pop(hid, None)
+    st.session_state._parsed_cache.pop(hid, None)
+    get_history_writer().append({"id": hid, "_deleted": True})
+
+def clear_selection_state():
+    for k in [k for k in list(st.session_state.keys()) if k.startswith(("sel_", "rev_"))]:
         st.session_state.pop(k, None)
 
 # ---------- INTERACTIVE MCQ ----------
+def _set_state(key: str, value):
+    st.session_state[key] = value
+
 def render_mcq_interactive(qid: int, question: str, options: List[str], correct_letter: str):
     sel_key = f"sel_{qid}"
     rev_key = f"rev_{qid}"
@@ -159,46 +494,43 @@ def render_mcq_interactive(qid: int, question: str, options: List[str], correct_
     chosen = st.session_state.get(sel_key)
     revealed = st.session_state.get(rev_key, False)
 
-    # initial state → buttons
+    # initial state → buttons (callbacks update state; Streamlit reruns after the click)
     if not chosen and not revealed:
         for opt in options:
             letter = opt.split(')')[0].strip().lower()
             label = opt
-            if st.button(label, key=f"optbtn-{qid}-{letter}", use_container_width=True):
-                st.session_state[sel_key] = letter
-                st.rerun()
+            st.button(label, key=f"optbtn-{qid}-{letter}", use_container_width=True,
+                      on_click=_set_state, args=(sel_key, letter))
 
-        if st.button("Show answer", key=f"reveal-{qid}", type="secondary"):
-            st.session_state[rev_key] = True
-            st.rerun()
+        st.button("Show answer", key=f"reveal-{qid}", type="secondary",
+                  on_click=_set_state, args=(rev_key, True))
         return
 
-    # colored tiles after selection/reveal
-    for opt in options:
+    # colored tiles after selection/reveal, sent as a single markdown element
+    def css_for(opt: str) -> str:
         letter = opt.split(')')[0].strip().lower()
         if revealed:
             if letter == correct_letter:
-                css = "option-correct"
-            elif chosen and letter == chosen and chosen != correct_letter:
-                css = "option-wrong"
-            else:
-                css = "option-neutral"
-        else:
-            if chosen == letter:
-                css = "option-correct" if letter == correct_letter else "option-wrong"
-            else:
-                css = "option-neutral"
-        st.markdown(f'<div class="option-tile {css}">{opt}</div>', unsafe_allow_html=True)
+                return "option-correct"
+            if chosen and letter == chosen and chosen != correct_letter:
+                return "option-wrong"
+            return "option-neutral"
+        if chosen == letter:
+            return "option-correct" if letter == correct_letter else "option-wrong"
+        return "option-neutral"
+
+    html = "".join(f'<div class="option-tile {css_for(opt)}">{opt}</div>' for opt in options)
+    st.markdown(html, unsafe_allow_html=True)
 
     c1, c2 = st.columns([1,1])
     with c1:
-        if not revealed and st.button("Change selection", key=f"reset-{qid}"):
-            st.session_state.pop(sel_key, None)
-            st.rerun()
+        if not revealed:
+            st.button("Change selection", key=f"reset-{qid}",
+                      on_click=_set_state, args=(sel_key, None))
     with c2:
-        if not revealed and st.button("Show answer", key=f"reveal2-{qid}", type="secondary"):
-            st.session_state[rev_key] = True
-            st.rerun()
+        if not revealed:
+            st.button("Show answer", key=f"reveal2-{qid}", type="secondary",
+                      on_click=_set_state, args=(rev_key, True))
 
     if revealed:
         st.info(f"Answer: **{correct_letter})**")
@@ -227,26 +559,43 @@ with tab_generate:
         elif not topic.strip():
             st.warning("Enter a topic.")
         else:
-            with st.spinner("Generating…"):
-                raw = (mcq_prompt | llm | StrOutputParser()).invoke(
-                    {"topic": topic.strip(), "num_questions": int(num_questions)}
-                )
-            blocks = parse_mcqs(raw)
-
-            # persist for reruns
-            st.session_state.current_blocks = blocks
-            st.session_state.current_raw = raw
-            st.session_state.current_topic = topic
-            st.session_state.current_num = int(num_questions)
-
-            clear_selection_state(len(blocks))
+            # near-duplicate topics for the same model/count reuse a cached response;
+            # only in reproducible mode, otherwise the user wants a fresh set
+            # (model/count are matched exactly in SQL, so only the topic is embedded)
+            topic_norm = topic.strip().lower()
+            topic_key = f"{model_name}|{int(num_questions)}|{topic_norm}"
+            emb = embed(topic_norm) if deterministic else None
+            cache_filter = {"model": model_name, "num": int(num_questions)}
+            hit = get_cache().get(emb, threshold=0.9, filter=cache_filter) if emb is not None else None
+
+            raw = hit
+            if not raw:
+                try:
+                    raw = generate_mcqs(model_name, deterministic, topic.strip(), int(num_questions))
+                except Exception as e:  # model not served, rate limit, network …
+                    st.error(f"Generation failed: {e}")
+            if raw:
+                blocks = parse_mcqs(raw)
+
+                # only cache complete sets, so refusals or truncated output aren't replayed
+                complete = len(blocks) == int(num_questions) and all(b["answer"] for b in blocks)
+                if not hit and emb is not None and complete:
+                    get_cache().set(emb, raw, model=model_name, num=int(num_questions), key=topic_key)
+
+                # persist for reruns
+                st.session_state.current_blocks = blocks
+                st.session_state.current_raw = raw
+                st.session_state.current_topic = topic
+                st.session_state.current_num = int(num_questions)
+
+                clear_selection_state()
+
+                # Save to history
+                st.session_state.messages.append(HumanMessage(content=f"Topic: {topic}, Questions: {num_questions}"))
+                st.session_state.messages.append(AIMessage(content=raw))
+                add_to_history(topic, num_questions, raw)
 
-            # Save to history
-            st.session_state.messages.append(HumanMessage(content=f"Topic: {topic}, Questions: {num_questions}"))
-            st.session_state.messages.append(AIMessage(content=raw))
-            add_to_history(topic, num_questions, raw)
-
-            st.rerun()
+                st.rerun()
 
     # render current set (keeps state on reruns)
     blocks = st.session_state.current_blocks
@@ -269,12 +618,16 @@ with tab_generate:
 with tab_history:
     q = st.text_input("Search in history", placeholder="e.g., tree, dbms, numpy")
     newest_first = st.toggle("Newest first", value=True)
-    items = st.session_state.history
+    items = list(st.session_state.history.values())
     if q:
         qlow = q.lower()
-        items = [h for h in items if (qlow in h["topic"].lower() or qlow in h["response"].lower())]
+        items = [h for h in items if (qlow in h["_topic_l"] or qlow in h["_resp_l"])]
     if newest_first:
-        items = list(reversed(items))
+        # timestamps sort lexicographically; id breaks ties within the same minute
+        items = sorted(items, key=lambda h: (h["ts"], h["id"]), reverse=True)
+
+    total = len(items)
+    items = items[:st.session_state._hist_page]
 
     if not items:
         st.info("No history yet. Generate in the first tab.")
@@ -282,8 +635,9 @@ with tab_history:
         for h in items:
             with st.container(border=True):
                 st.markdown(f"#{h['id']} • {h['ts']} • **{h['topic']}** ({h['num']} Qs)")
-                with st.expander("Preview MCQs", expanded=False):
-                    prev_blocks = parse_mcqs(h["response"])
+                # a toggle rather than st.expander: expander bodies run (and parse) even when collapsed
+                if st.toggle("Preview MCQs", key=f"exp_{h['id']}"):
+                    prev_blocks = parsed_history_blocks(h)
                     if prev_blocks:
                         for i, b in enumerate(prev_blocks):
                             st.markdown(f"**Q{i+1}. {b['question']}**")
@@ -305,15 +659,19 @@ with tab_history:
                     )
                 with cB:
                     if st.button("Load this set", key=f"load-{h['id']}"):
-                        st.session_state.current_blocks = parse_mcqs(h["response"])
+                        st.session_state.current_blocks = parsed_history_blocks(h)
                         st.session_state.current_raw = h["response"]
                         st.session_state.current_topic = h["topic"]
                         st.session_state.current_num = h["num"]
-                        clear_selection_state(len(st.session_state.current_blocks))
+                        clear_selection_state()
                         st.toast("Loaded into Generate tab.")
                         st.rerun()
                 with cC:
                     if st.button("Delete", key=f"del-{h['id']}"):
-                        st.session_state.history = [x for x in st.session_state.history if x["id"] != h["id"]]
-                        save_history(st.session_state.history)
+                        delete_from_history(h["id"])
                         st.rerun()
+
+        if total > len(items):
+            st.caption(f"Showing {len(items)} of {total}")
+            st.button("Show more", key="hist-more", on_click=_set_state,
+                      args=("_hist_page", st.session_state._hist_page + HISTORY_PAGE))